@@ -123,6 +123,9 @@ PPO_PARAMS = dict(
     # value function clipping (and recover the original PPO implementation),
     # you have to pass a negative value (e.g. -1).
     cliprange_vf=None,
+    # whether to compute the clipped surrogate policy objective in half
+    # precision
+    use_fp16=False,
 )
 
 
@@ -1,7 +1,10 @@
 """Script containing the abstract policy class."""
+import functools
 import numpy as np
 import tensorflow as tf
+from gym.spaces import Box
 
+from hbaselines.utils.misc import aligned_empty
 from hbaselines.utils.tf_util import get_trainable_vars
 
 
@@ -145,6 +148,19 @@ class Policy(object):
             "\"model_type\" in model_params must be one of {\"conv\", "
             "\"fcnet\"}.")
 
+        # Create a reusable buffer for single observations and contexts that
+        # are concatenated when computing actions, as well as the views of
+        # this buffer that the two terms are copied to. See _get_single_obs.
+        self._obs_scratch = None
+        self._obs_scratch_views = None
+        if isinstance(ob_space, Box) and isinstance(co_space, Box) \
+                and len(ob_space.shape) == 1 and len(co_space.shape) == 1:
+            n_obs = ob_space.shape[0]
+            self._obs_scratch = aligned_empty(
+                (1,) + self._get_ob_dim(ob_space, co_space))
+            self._obs_scratch_views = (
+                self._obs_scratch[:, :n_obs], self._obs_scratch[:, n_obs:])
+
     def initialize(self):
         """Initialize the policy.
 
@@ -263,10 +279,41 @@ class Policy(object):
             the processed observation
         """
         if context is not None:
-            context = context.flatten() if axis == 0 else context
+            # ravel only copies the context if it is not already contiguous.
+            context = np.ravel(context) if axis == 0 else context
             obs = np.concatenate((obs, context), axis=axis)
         return obs
 
+    def _get_single_obs(self, obs, context):
+        """Return the processed observation of a single step.
+
+        This is equivalent to `_get_obs(obs, context, axis=1)`. If the
+        observation consists of a single sample, the observation and
+        contextual term are copied into a preallocated array, which is
+        returned. Note that this array is overwritten by the next call to this
+        method.
+
+        Parameters
+        ----------
+        obs : array_like
+            the original observation
+        context : array_like or None
+            the contextual term. Set to None if no context is provided by the
+            environment.
+
+        Returns
+        -------
+        array_like
+            the processed observation
+        """
+        if context is None or self._obs_scratch is None or len(obs) != 1:
+            return self._get_obs(obs, context, axis=1)
+
+        np.copyto(self._obs_scratch_views[0], obs)
+        np.copyto(self._obs_scratch_views[1], context)
+
+        return self._obs_scratch
+
     @staticmethod
     def _get_ob_dim(ob_space, co_space):
         """Return the processed observation dimension.
@@ -286,13 +333,11 @@ class Policy(object):
         tuple
             the true observation dimension
         """
-        ob_dim = ob_space.shape
-        if co_space is not None:
-            ob_dim = tuple(map(sum, zip(ob_dim, co_space.shape)))
-        return ob_dim
+        return _compute_ob_dim(
+            ob_space.shape, None if co_space is None else co_space.shape)
 
     @staticmethod
-    def _l2_loss(l2_penalty, scope_name):
+    def _l2_loss(l2_penalty, scope_name, var_list=None):
         """Compute the L2 regularization penalty.
 
         Parameters
@@ -301,6 +346,9 @@ class Policy(object):
             L2 regularization penalty
         scope_name : str
             the scope of the trainable variables to regularize
+        var_list : list of tf.Variable or None
+            the variables to regularize. If set to None, the trainable
+            variables in `scope_name` are collected and used instead.
 
         Returns
         -------
@@ -309,13 +357,29 @@ class Policy(object):
         """
         if l2_penalty > 0:
             print("regularizing policy network: L2 = {}".format(l2_penalty))
+            if var_list is None:
+                var_list = get_trainable_vars(scope_name)
             regularizer = tf.contrib.layers.l2_regularizer(
                 scale=l2_penalty, scope="{}/l2_regularize".format(scope_name))
             l2_loss = tf.contrib.layers.apply_regularization(
                 regularizer,
-                weights_list=get_trainable_vars(scope_name))
+                weights_list=var_list)
         else:
             # no regularization
             l2_loss = 0
 
         return l2_loss
+
+
+@functools.lru_cache(maxsize=None)
+def _compute_ob_dim(ob_shape, co_shape):
+    """Return the processed observation dimension from the space shapes.
+
+    This is cached since it is called every time a policy is created, and
+    hierarchical and multi-agent policies may create many sub-policies with
+    the same observation and context spaces.
+    """
+    ob_dim = ob_shape
+    if co_shape is not None:
+        ob_dim = tuple((np.asarray(ob_dim) + np.asarray(co_shape)).tolist())
+    return ob_dim
@@ -1,14 +1,24 @@
 """PPO-compatible feedforward policy."""
 import numpy as np
 import tensorflow as tf
+from tensorflow.core.protobuf.config_pb2 import CallableOptions
 
 from hbaselines.base_policies import Policy
+from hbaselines.utils.misc import aligned_empty
 from hbaselines.utils.tf_util import create_fcnet
 from hbaselines.utils.tf_util import create_conv
 from hbaselines.utils.tf_util import get_trainable_vars
 from hbaselines.utils.tf_util import explained_variance
 from hbaselines.utils.tf_util import print_params_shape
 from hbaselines.utils.tf_util import process_minibatch
+from hbaselines.utils.tf_util import flatten_grads
+from hbaselines.utils.tf_util import clip_by_global_norm_flat
+from hbaselines.utils.tf_util import flat_adam
+from hbaselines.utils.tf_util import scale_gradient
+
+# Static loss scale of the half precision operations of the PPO surrogate
+# objective, if use_fp16 is set to True. See FeedForwardPolicy._setup_losses.
+FP16_LOSS_SCALE = 1024.
 
 
 class FeedForwardPolicy(Policy):
@@ -42,6 +52,9 @@ class FeedForwardPolicy(Policy):
         IMPORTANT: this clipping depends on the reward scaling. To deactivate
         value function clipping (and recover the original PPO implementation),
         you have to pass a negative value (e.g. -1).
+    use_fp16 : bool
+        whether to compute the clipped surrogate policy objective in half
+        precision
     num_envs : int
         number of environments used to run simulations in parallel.
     mb_rewards : array_like
@@ -67,6 +80,10 @@ class FeedForwardPolicy(Policy):
         GAE terms.
     mb_advs : array_like
         a minibatch of estimated advantages
+    mb_idx_ph : tf.compat.v1.placeholder
+        placeholder for the indices of the samples in the current rollout that
+        form a minibatch. Defaults to the next batch of shuffled indices from
+        an iterator that is initialized at the start of every update.
     rew_ph : tf.compat.v1.placeholder
         placeholder for the rewards / discounted returns
     action_ph : tf.compat.v1.placeholder
@@ -127,6 +144,7 @@ class FeedForwardPolicy(Policy):
                  cliprange,
                  cliprange_vf,
                  l2_penalty,
+                 use_fp16=False,
                  scope=None,
                  num_envs=1):
         """Instantiate the policy object.
@@ -175,6 +193,10 @@ class FeedForwardPolicy(Policy):
             scaling. To deactivate value function clipping (and recover the
             original PPO implementation), you have to pass a negative value
             (e.g. -1).
+        use_fp16 : bool
+            whether to compute the clipped surrogate policy objective in half
+            precision. The model parameters, their gradients, and the
+            optimizer remain in single precision.
         """
         super(FeedForwardPolicy, self).__init__(
             sess=sess,
@@ -197,6 +219,7 @@ class FeedForwardPolicy(Policy):
         self.max_grad_norm = max_grad_norm
         self.cliprange = cliprange
         self.cliprange_vf = cliprange_vf
+        self.use_fp16 = use_fp16
 
         # Create variables to store on-policy data.
         self.mb_rewards = [[] for _ in range(num_envs)]
@@ -215,36 +238,67 @@ class FeedForwardPolicy(Policy):
         # the contextual term.
         ob_dim = self._get_ob_dim(ob_space, co_space)
 
+        # Create a reusable buffer for the last observations of every
+        # environment. See _get_last_values.
+        self._last_obs_scratch = aligned_empty((num_envs,) + ob_dim)
+
         # =================================================================== #
         # Step 1: Create input variables.                                     #
         # =================================================================== #
 
+        self._rollout_ph = []
+        self._rollout_assign = []
+
         with tf.compat.v1.variable_scope("input", reuse=False):
-            self.rew_ph = tf.compat.v1.placeholder(
-                tf.float32,
+            # Create a stream of shuffled minibatch indices that covers every
+            # optimization epoch of an update procedure.
+            self._n_steps_ph = tf.compat.v1.placeholder(
+                tf.int64,
+                shape=(),
+                name="n_steps")
+            self._batch_size_ph = tf.compat.v1.placeholder(
+                tf.int64,
+                shape=(),
+                name="batch_size")
+            # The shuffling seed is drawn from numpy's random number generator
+            # every update, so that the order of the minibatches is fixed by
+            # the seed of the training procedure.
+            self._shuffle_seed_ph = tf.compat.v1.placeholder(
+                tf.int64,
+                shape=(),
+                name="shuffle_seed")
+            self._mb_iterator = tf.compat.v1.data.make_initializable_iterator(
+                tf.data.Dataset.range(self._n_steps_ph)
+                .shuffle(self._n_steps_ph, seed=self._shuffle_seed_ph)
+                .batch(self._batch_size_ph)
+                .repeat(n_opt_epochs)
+                .prefetch(tf.data.experimental.AUTOTUNE))
+            self.mb_idx_ph = tf.compat.v1.placeholder_with_default(
+                tf.cast(self._mb_iterator.get_next(), tf.int32),
                 shape=(None,),
+                name="mb_idx")
+            self.rew_ph = self._create_rollout_input(
+                shape=(),
                 name='rewards')
-            self.action_ph = tf.compat.v1.placeholder(
-                tf.float32,
-                shape=(None,) + ac_space.shape,
+            self.action_ph = self._create_rollout_input(
+                shape=ac_space.shape,
                 name='actions')
-            self.obs_ph = tf.compat.v1.placeholder(
-                tf.float32,
-                shape=(None,) + ob_dim,
+            self.obs_ph = self._create_rollout_input(
+                shape=ob_dim,
                 name='obs0')
-            self.advs_ph = tf.placeholder(
-                tf.float32,
-                shape=(None,),
+            self.advs_ph = self._create_rollout_input(
+                shape=(),
                 name="advs_ph")
-            self.old_neglog_pac_ph = tf.placeholder(
-                tf.float32,
-                shape=(None,),
+            self.old_neglog_pac_ph = self._create_rollout_input(
+                shape=(),
                 name="old_neglog_pac_ph")
-            self.old_vpred_ph = tf.placeholder(
-                tf.float32,
-                shape=(None,),
+            self.old_vpred_ph = self._create_rollout_input(
+                shape=(),
                 name="old_vpred_ph")
 
+        self._load_rollout = tf.group(*self._rollout_assign)
+        self._rollout_data = [None for _ in self._rollout_ph]
+
         # =================================================================== #
         # Step 2: Create actor and critic variables.                          #
         # =================================================================== #
@@ -263,6 +317,11 @@ class FeedForwardPolicy(Policy):
             self.value_fn = self.make_critic(self.obs_ph, scope="vf")
             self.value_flat = self.value_fn[:, 0]
 
+            # Collect the trainable variables of the model once. These are
+            # reused by the regularization penalty and the optimizer.
+            self._model_vars = get_trainable_vars(
+                tf.compat.v1.get_variable_scope().name + "/")
+
         # =================================================================== #
         # Step 4: Setup the optimizers for the actor and critic.              #
         # =================================================================== #
@@ -283,6 +342,68 @@ class FeedForwardPolicy(Policy):
 
         self._setup_stats(scope or "Model")
 
+        # =================================================================== #
+        # Step 6: Create callables for the optimization procedure.            #
+        # =================================================================== #
+
+        # These are run once per minibatch. Callables avoid parsing the
+        # fetches and feeds of the session on every call. Note that
+        # make_callable delegates calls with a non-empty feed list to
+        # Session.run, so the callable with feeds is created from its options
+        # instead.
+        self._train_step = self.sess.make_callable(self.optimizer)
+        self._train_step_from_batch = self.sess._make_callable_from_options(
+            CallableOptions(
+                feed=[ph.name for ph in [
+                    self.obs_ph,
+                    self.action_ph,
+                    self.advs_ph,
+                    self.rew_ph,
+                    self.old_neglog_pac_ph,
+                    self.old_vpred_ph,
+                ]],
+                target=[self.optimizer.name]))
+
+    def _create_rollout_input(self, shape, name):
+        """Create an input placeholder that is backed by a rollout buffer.
+
+        The full rollout is copied once per update into a non-trainable
+        variable, and minibatches are then gathered from this variable using
+        the indices in `mb_idx_ph`. This avoids feeding every minibatch from
+        the host during the optimization procedure.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            the shape of a single sample
+        name : str
+            the name of the placeholder
+
+        Returns
+        -------
+        tf.Tensor
+            a placeholder that defaults to the gathered minibatch of data, but
+            may also be fed directly
+        """
+        rollout_ph = tf.compat.v1.placeholder(
+            tf.float32,
+            shape=(None,) + shape,
+            name="{}_rollout".format(name))
+        rollout_buf = tf.Variable(
+            tf.zeros((0,) + shape),
+            trainable=False,
+            validate_shape=False,
+            name="{}_buffer".format(name))
+
+        self._rollout_ph.append(rollout_ph)
+        self._rollout_assign.append(tf.compat.v1.assign(
+            rollout_buf, rollout_ph, validate_shape=False))
+
+        return tf.compat.v1.placeholder_with_default(
+            tf.gather(rollout_buf, self.mb_idx_ph),
+            shape=(None,) + shape,
+            name=name)
+
     def make_actor(self, obs, reuse=False, scope="pi"):
         """Create an actor tensor.
 
@@ -416,6 +537,49 @@ class FeedForwardPolicy(Policy):
             print('setting up critic optimizer')
             print_params_shape("{}vf/".format(scope_name), "critic")
 
+        # The loss is a long chain of small element-wise operations over the
+        # batch dimension. Mark it for XLA compilation so that these
+        # operations are fused into a small number of kernels. The gradients
+        # of these operations are compiled as well.
+        with tf.xla.experimental.jit_scope():
+            self._setup_losses()
+
+        # Add a regularization penalty.
+        self.loss += self._l2_loss(
+            self.l2_penalty, scope_name, var_list=self._model_vars)
+
+        # Compute the gradients of the loss.
+        var_list = self._model_vars
+        grads = tf.gradients(self.loss, var_list)
+
+        flat_grad = flatten_grads(grads, var_list)
+
+        # Perform gradient clipping if requested.
+        if self.max_grad_norm is not None:
+            flat_grad, _grad_norm = clip_by_global_norm_flat(
+                flat_grad, self.max_grad_norm)
+
+        # Create the operation that applies the gradients. The moments of all
+        # variables are updated together, instead of once per variable.
+        self.optimizer = flat_adam(
+            flat_grad=flat_grad,
+            var_list=var_list,
+            learning_rate=self.learning_rate,
+            epsilon=1e-5,
+        )
+
+    def _setup_losses(self):
+        """Create the PPO loss and the operations that are used to log it.
+
+        If `use_fp16` is set to True, the clipped surrogate policy objective
+        is computed in half precision, and a static loss scale (see
+        FP16_LOSS_SCALE) is applied to its gradients. The probability ratios
+        are not bounded, so the unclipped objective, the maximum over both
+        objectives, the value function loss, the approximate KL divergence,
+        all reductions, and as a result the gradients of the model parameters,
+        are still computed in single precision.
+        """
+
         neglogpac = self._neglogp(self.action_ph)
         self.entropy = tf.reduce_sum(
             tf.reshape(self.pi_logstd, [-1])
@@ -439,39 +603,57 @@ class FeedForwardPolicy(Policy):
 
         vf_losses1 = tf.square(self.value_flat - self.rew_ph)
         vf_losses2 = tf.square(vpred_clipped - self.rew_ph)
-        self.vf_loss = .5 * tf.reduce_mean(tf.maximum(vf_losses1, vf_losses2))
-
-        ratio = tf.exp(self.old_neglog_pac_ph - neglogpac)
-        pg_losses = -self.advs_ph * ratio
-        pg_losses2 = -self.advs_ph * tf.clip_by_value(
-            ratio, 1.0 - self.cliprange, 1.0 + self.cliprange)
-        self.pg_loss = tf.reduce_mean(tf.maximum(pg_losses, pg_losses2))
-        self.approxkl = .5 * tf.reduce_mean(
-            tf.square(neglogpac - self.old_neglog_pac_ph))
-        self.clipfrac = tf.reduce_mean(tf.cast(tf.greater(
-            tf.abs(ratio - 1.0), self.cliprange), tf.float32))
+        vf_losses = .5 * tf.maximum(vf_losses1, vf_losses2)
+
+        # The log-ratio is computed in single precision, since it is the
+        # difference of two potentially large terms.
+        log_ratio = self.old_neglog_pac_ph - neglogpac
+
+        # The clipping range is fixed, so its bounds are computed once here
+        # and embedded in the graph as constants.
+        ratio_min = 1.0 - self.cliprange
+        ratio_max = 1.0 + self.cliprange
+
+        neg_advs = -self.advs_ph
+        ratio = tf.exp(log_ratio)
+        clipped_ratio = tf.clip_by_value(ratio, ratio_min, ratio_max)
+        if self.use_fp16:
+            # Only the clipped objective, whose ratios lie within the clipping
+            # range, is computed in half precision. Its gradients are scaled
+            # up while in half precision, so that the per-sample gradients of
+            # large minibatches do not underflow.
+            clipped_ratio = tf.cast(
+                scale_gradient(clipped_ratio, 1. / FP16_LOSS_SCALE),
+                tf.float16)
+            clipped_pg_losses = scale_gradient(
+                tf.cast(tf.cast(neg_advs, tf.float16) * clipped_ratio,
+                        tf.float32),
+                FP16_LOSS_SCALE)
+            pg_losses = tf.maximum(neg_advs * ratio, clipped_pg_losses)
+        else:
+            # The clipped and unclipped surrogate objectives are computed with
+            # a single product between the negative advantages and both
+            # ratios.
+            ratios = tf.stack([ratio, clipped_ratio], axis=0)
+            pg_losses = tf.reduce_max(neg_advs[None, :] * ratios, axis=0)
+        approxkls = .5 * tf.square(log_ratio)
+        clipfracs = tf.cast(tf.abs(ratio - 1.0) > self.cliprange, tf.float32)
+
+        # Average all per-sample terms with a single reduction.
+        per_sample = tf.stack([
+            pg_losses,
+            vf_losses,
+            approxkls,
+            clipfracs,
+        ], axis=0)
+        (self.pg_loss,
+         self.vf_loss,
+         self.approxkl,
+         self.clipfrac) = tf.unstack(tf.reduce_mean(per_sample, axis=1))
+
         self.loss = self.pg_loss - self.entropy * self.ent_coef \
             + self.vf_loss * self.vf_coef
 
-        # Add a regularization penalty.
-        self.loss += self._l2_loss(self.l2_penalty, scope_name)
-
-        # Compute the gradients of the loss.
-        var_list = get_trainable_vars(scope_name)
-        grads = tf.gradients(self.loss, var_list)
-
-        # Perform gradient clipping if requested.
-        if self.max_grad_norm is not None:
-            grads, _grad_norm = tf.clip_by_global_norm(
-                grads, self.max_grad_norm)
-        grads = list(zip(grads, var_list))
-
-        # Create the operation that applies the gradients.
-        self.optimizer = tf.train.AdamOptimizer(
-            learning_rate=self.learning_rate,
-            epsilon=1e-5
-        ).apply_gradients(grads)
-
     def _setup_stats(self, base):
         """Create the running means and std of the model inputs and outputs.
 
@@ -509,7 +691,7 @@ class FeedForwardPolicy(Policy):
     def get_action(self, obs, context, apply_noise, random_actions, env_num=0):
         """See parent class."""
         # Add the contextual observation, if applicable.
-        obs = self._get_obs(obs, context, axis=1)
+        obs = self._get_single_obs(obs, context)
 
         action, values, neglogpacs = self.sess.run(
             [self.action if apply_noise else self.pi_mean,
@@ -526,7 +708,7 @@ class FeedForwardPolicy(Policy):
     def value(self, obs, context):
         """See parent class."""
         # Add the contextual observation, if applicable.
-        obs = self._get_obs(obs, context, axis=1)
+        obs = self._get_single_obs(obs, context)
 
         return self.sess.run(self.value_flat, {self.obs_ph: obs})
 
@@ -577,12 +759,7 @@ class FeedForwardPolicy(Policy):
     def update(self, **kwargs):
         """See parent class."""
         # Compute the last estimated value.
-        last_values = [
-            self.sess.run(
-                self.value_flat,
-                feed_dict={self.obs_ph: self.last_obs[env_num]})
-            for env_num in range(self.num_envs)
-        ]
+        last_values = self._get_last_values()
 
         (self.mb_obs,
          self.mb_contexts,
@@ -609,25 +786,111 @@ class FeedForwardPolicy(Policy):
             num_envs=self.num_envs,
         )
 
-        # Run the optimization procedure.
+        # Store the full rollout in the input buffers.
+        self.load_rollout(
+            obs=self.mb_obs,
+            context=None if self.mb_contexts[0] is None else self.mb_contexts,
+            returns=self.mb_returns,
+            actions=self.mb_actions,
+            values=self.mb_values,
+            advs=self.mb_advs,
+            neglogpacs=self.mb_neglogpacs,
+        )
+
+        # Run the optimization procedure. The minibatches are read from the
+        # iterator, so no data needs to be fed here.
+        for _ in range(self._init_minibatches(n_steps)):
+            self._train_step()
+
+    def _get_last_values(self):
+        """Return the estimated values of the last observations.
+
+        The values of all environments are computed in a single call.
+
+        Returns
+        -------
+        array_like
+            the estimated value of the last observation of every environment
+        """
+        last_obs = np.concatenate(
+            self.last_obs, axis=0, out=self._last_obs_scratch)
+
+        return self.sess.run(
+            self.value_flat, feed_dict={self.obs_ph: last_obs})
+
+    def _init_minibatches(self, n_steps):
+        """Shuffle the samples of a rollout into minibatches for every epoch.
+
+        Parameters
+        ----------
+        n_steps : int
+            the number of samples in the rollout
+
+        Returns
+        -------
+        int
+            the number of minibatches over all epochs. If the number of
+            samples is not divisible by the number of minibatches, the last
+            minibatch of every epoch contains the remaining samples.
+        """
         batch_size = n_steps // self.n_minibatches
+        self.sess.run(self._mb_iterator.initializer, {
+            self._n_steps_ph: n_steps,
+            self._batch_size_ph: batch_size,
+            self._shuffle_seed_ph: np.random.randint(np.iinfo(np.int32).max),
+        })
+
+        return self.n_opt_epochs * -(-n_steps // batch_size)
+
+    def load_rollout(self,
+                     obs,
+                     context,
+                     returns,
+                     actions,
+                     values,
+                     advs,
+                     neglogpacs):
+        """Copy a full rollout of data into the input buffers.
 
-        inds = np.arange(n_steps)
-        for _ in range(self.n_opt_epochs):
-            np.random.shuffle(inds)
-            for start in range(0, n_steps, batch_size):
-                end = start + batch_size
-                mbinds = inds[start:end]
-                self.update_from_batch(
-                    obs=self.mb_obs[mbinds],
-                    context=None if self.mb_contexts[0] is None
-                    else self.mb_contexts[mbinds],
-                    returns=self.mb_returns[mbinds],
-                    actions=self.mb_actions[mbinds],
-                    values=self.mb_values[mbinds],
-                    advs=self.mb_advs[mbinds],
-                    neglogpacs=self.mb_neglogpacs[mbinds],
-                )
+        Minibatches are subsequently sampled from these buffers by the indices
+        in `mb_idx_ph`.
+
+        Parameters
+        ----------
+        obs : array_like
+            a rollout of observations
+        context : array_like
+            a rollout of contextual terms
+        returns : array_like
+            a rollout of contextual expected discounted returns
+        actions : array_like
+            a rollout of actions
+        values : array_like
+            a rollout of estimated values by the policy
+        advs : array_like
+            a rollout of estimated advantages
+        neglogpacs : array_like
+            a rollout of the negative log-likelihood of performed actions
+        """
+        # Add the contextual observation, if applicable.
+        obs = self._get_obs(obs, context, axis=1)
+
+        # The placeholders are ordered as they are created in __init__.
+        data = [returns, actions, obs, advs, neglogpacs, values]
+
+        # Stage the data in aligned single precision arrays. These can be
+        # passed to the session without any additional conversions or copies.
+        # The arrays are reused as long as the size of the rollout does not
+        # change.
+        for i, val in enumerate(data):
+            val = np.asarray(val)
+            if self._rollout_data[i] is None \
+                    or self._rollout_data[i].shape != val.shape:
+                self._rollout_data[i] = aligned_empty(val.shape)
+            np.copyto(self._rollout_data[i], val)
+
+        self.sess.run(self._load_rollout, dict(zip(
+            self._rollout_ph, self._rollout_data)))
 
     def update_from_batch(self,
                           obs,
@@ -659,14 +922,11 @@ class FeedForwardPolicy(Policy):
         # Add the contextual observation, if applicable.
         obs = self._get_obs(obs, context, axis=1)
 
-        return self.sess.run(self.optimizer, {
-            self.obs_ph: obs,
-            self.action_ph: actions,
-            self.advs_ph: advs,
-            self.rew_ph: returns,
-            self.old_neglog_pac_ph: neglogpacs,
-            self.old_vpred_ph: values,
-        })
+        # The callable does not convert its inputs, so they are passed as
+        # contiguous single precision arrays.
+        self._train_step_from_batch(*[
+            np.ascontiguousarray(val, dtype=np.float32)
+            for val in [obs, actions, advs, returns, neglogpacs, values]])
 
     def get_td_map(self):
         """See parent class."""
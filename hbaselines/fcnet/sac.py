@@ -523,7 +523,7 @@ class FeedForwardPolicy(ActorCriticPolicy):
     def get_action(self, obs, context, apply_noise, random_actions, env_num=0):
         """See parent class."""
         # Add the contextual observation, if applicable.
-        obs = self._get_obs(obs, context, axis=1)
+        obs = self._get_single_obs(obs, context)
 
         if random_actions:
             return np.array([self.ac_space.sample()])
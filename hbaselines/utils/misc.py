@@ -4,6 +4,7 @@ import errno
 import functools
 import inspect
 import warnings
+import numpy as np
 
 
 def ensure_dir(path):
@@ -58,3 +59,36 @@ def recursive_update(d, u):
         else:
             d[k] = v
     return d
+
+
+def aligned_empty(shape, dtype=np.float32, alignment=64):
+    """Return an uninitialized array whose data is aligned in memory.
+
+    TensorFlow is able to ingest aligned arrays without any additional copies
+    or unaligned memory accesses, which makes these arrays suitable as
+    reusable buffers for data that is repeatedly fed to a session.
+
+    Parameters
+    ----------
+    shape : int or tuple of int
+        the shape of the array
+    dtype : type
+        the data type of the array
+    alignment : int
+        the alignment of the data, in bytes
+
+    Returns
+    -------
+    array_like
+        the aligned array
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+
+    # Allocate enough space to shift the start of the array to an aligned
+    # address.
+    buf = np.empty(size * dtype.itemsize + alignment, dtype=np.uint8)
+    offset = -buf.ctypes.data % alignment
+
+    return buf[offset:offset + size * dtype.itemsize].view(dtype).reshape(
+        shape)
@@ -4,6 +4,12 @@ import tensorflow.contrib.slim as slim
 import numpy as np
 from functools import reduce
 
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional; the numpy implementations are used instead
+    njit = None
+
 # Stabilizing term to avoid NaN (prevents division by zero or log of zero)
 EPS = 1e-6
 
@@ -151,6 +157,148 @@ def get_target_updates(_vars, target_vars, tau, verbose=0):
     return tf.group(*init_updates), tf.group(*soft_updates)
 
 
+def flatten_grads(grads, var_list):
+    """Concatenate a list of gradients into a single vector.
+
+    Parameters
+    ----------
+    grads : list of tf.Tensor or None
+        the gradients of each variable. None elements are treated as zeros.
+    var_list : list of tf.Variable
+        the variables that the gradients correspond to
+
+    Returns
+    -------
+    tf.Tensor
+        the flattened gradients
+    """
+    return tf.concat([
+        tf.reshape(tf.zeros_like(var) if grad is None else grad, [-1])
+        for grad, var in zip(grads, var_list)
+    ], axis=0)
+
+
+def clip_by_global_norm_flat(flat_grad, clip_norm):
+    """Clip a flattened set of gradients by their global norm.
+
+    This is equivalent to tf.clip_by_global_norm, but computes the norm with a
+    single reduction over the flattened gradients instead of one reduction per
+    gradient.
+
+    Parameters
+    ----------
+    flat_grad : tf.Tensor
+        the flattened gradients, see flatten_grads
+    clip_norm : float
+        the maximum global norm
+
+    Returns
+    -------
+    tf.Tensor
+        the clipped flattened gradients
+    tf.Tensor
+        the global norm of the gradients before clipping
+    """
+    global_norm = tf.norm(flat_grad)
+    scale = clip_norm / tf.maximum(global_norm, clip_norm)
+
+    return flat_grad * scale, global_norm
+
+
+def scale_gradient(tensor, scale):
+    """Return an identity of a tensor, with its gradient scaled by a factor.
+
+    This is used to apply a static loss scale around operations that are
+    computed in half precision: the gradients are multiplied by the scale
+    where they enter the half precision operations, and divided by it where
+    they leave them, so that small gradients do not underflow.
+
+    Parameters
+    ----------
+    tensor : tf.Tensor
+        the input tensor
+    scale : float
+        the factor to multiply the gradient of the tensor by
+
+    Returns
+    -------
+    tf.Tensor
+        the output tensor
+    """
+    @tf.custom_gradient
+    def _scale_gradient(x):
+        def grad(dy):
+            return dy * scale
+        return tf.identity(x), grad
+
+    return _scale_gradient(tensor)
+
+
+def flat_adam(flat_grad,
+              var_list,
+              learning_rate,
+              beta1=0.9,
+              beta2=0.999,
+              epsilon=1e-8,
+              name="flat_adam"):
+    """Create an Adam update operation over a flattened set of variables.
+
+    Unlike tf.compat.v1.train.AdamOptimizer, which creates a separate update
+    operation for every variable, the moments of all variables are stored and
+    updated as single vectors. The resulting step is then split and applied to
+    each variable. The update rule is otherwise identical.
+
+    Parameters
+    ----------
+    flat_grad : tf.Tensor
+        the flattened gradients of the variables, see flatten_grads
+    var_list : list of tf.Variable
+        the variables to update
+    learning_rate : float
+        the learning rate
+    beta1 : float
+        the exponential decay rate for the 1st moment estimates
+    beta2 : float
+        the exponential decay rate for the 2nd moment estimates
+    epsilon : float
+        a small constant for numerical stability
+    name : str
+        the name scope of the optimizer variables and operations
+
+    Returns
+    -------
+    tf.Operation
+        the operation that updates the variables
+    """
+    sizes = [int(np.prod(var.shape.as_list())) for var in var_list]
+
+    with tf.compat.v1.name_scope(name):
+        # Create the moment estimates and step count.
+        m = tf.Variable(tf.zeros([sum(sizes)]), trainable=False, name="m")
+        v = tf.Variable(tf.zeros([sum(sizes)]), trainable=False, name="v")
+        t = tf.Variable(0., trainable=False, name="t")
+
+        # Update the moment estimates.
+        t_new = tf.compat.v1.assign_add(t, 1.)
+        m_new = tf.compat.v1.assign(
+            m, beta1 * m + (1. - beta1) * flat_grad)
+        v_new = tf.compat.v1.assign(
+            v, beta2 * v + (1. - beta2) * tf.square(flat_grad))
+
+        # Compute the bias-corrected step.
+        lr_t = learning_rate * tf.sqrt(1. - tf.pow(beta2, t_new)) \
+            / (1. - tf.pow(beta1, t_new))
+        flat_step = lr_t * m_new / (tf.sqrt(v_new) + epsilon)
+
+        # Apply the step to each variable.
+        updates = [
+            tf.compat.v1.assign_sub(var, tf.reshape(step, tf.shape(var)))
+            for var, step in zip(var_list, tf.split(flat_step, sizes))
+        ]
+
+    return tf.group(*updates)
+
+
 def gaussian_likelihood(input_, mu_, log_std):
     """Compute log likelihood of a gaussian.
 
@@ -572,6 +720,64 @@ def gae_returns(mb_rewards, mb_values, mb_dones, last_values, gamma, lam):
     return mb_returns
 
 
+def normalize_advantages(mb_returns, mb_values):
+    """Compute the normalized advantages of a full rollout.
+
+    The mean and standard deviation are accumulated in double precision to
+    avoid cancellation errors over large rollouts, and the output is cast back
+    to single precision.
+
+    Parameters
+    ----------
+    mb_returns : array_like
+        a rollout of expected discounted returns
+    mb_values : array_like
+        a rollout of estimated values by the policy
+
+    Returns
+    -------
+    array_like
+        the normalized advantages
+    """
+    if _normalize_adv is not None:
+        mb_returns = np.asarray(mb_returns, dtype=np.float64)
+        mb_values = np.asarray(mb_values, dtype=np.float64)
+        advs = np.empty(mb_returns.shape, dtype=np.float32)
+        _normalize_adv(mb_returns.ravel(), mb_values.ravel(), advs.ravel())
+        return advs
+
+    advs = np.subtract(mb_returns, mb_values, dtype=np.float64)
+    mean = np.mean(advs)
+    std = np.std(advs)
+    advs -= mean
+    advs /= std + 1e-8
+
+    return advs.astype(np.float32)
+
+
+def _normalize_adv_py(returns, values, out):
+    """Write the normalized advantages of a flat rollout into out.
+
+    The mean and variance are computed in a single pass using Welford's
+    algorithm. This is only used when compiled by numba. It is compiled
+    without fastmath, so that the order of the operations, and the handling of
+    NaN and inf values, match those of the numpy implementation.
+    """
+    mean = 0.
+    m2 = 0.
+    for i in range(returns.shape[0]):
+        delta = (returns[i] - values[i]) - mean
+        mean += delta / (i + 1)
+        m2 += delta * ((returns[i] - values[i]) - mean)
+
+    std = np.sqrt(m2 / max(returns.shape[0], 1))
+    for i in range(returns.shape[0]):
+        out[i] = (returns[i] - values[i] - mean) / (std + 1e-8)
+
+
+_normalize_adv = None if njit is None else njit(cache=True)(_normalize_adv_py)
+
+
 def process_minibatch(mb_obs,
                       mb_contexts,
                       mb_actions,
@@ -689,9 +895,9 @@ def process_minibatch(mb_obs,
         mb_all_obs = mb_all_obs[0]
         mb_returns = mb_returns[0]
 
-    # Compute the advantages.
-    advs = mb_returns - mb_values
-    mb_advs = (advs - advs.mean()) / (advs.std() + 1e-8)
+    # Compute the advantages. This is done once for the full rollout, not for
+    # each minibatch.
+    mb_advs = normalize_advantages(mb_returns, mb_values)
 
     return mb_obs, mb_contexts, mb_actions, mb_values, mb_neglogpacs, \
         mb_all_obs, mb_rewards, mb_returns, mb_dones, mb_advs, n_steps
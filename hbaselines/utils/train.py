@@ -99,6 +99,7 @@ def get_hyperparameters(args, policy):
             "max_grad_norm": args.max_grad_norm,
             "cliprange": args.cliprange,
             "cliprange_vf": args.cliprange_vf,
+            "use_fp16": args.use_fp16,
         })
 
     # add GoalConditionedPolicy parameters
@@ -446,6 +447,11 @@ def create_ppo_parser(parser):
              "clipping depends on the reward scaling. To deactivate value "
              "function clipping (and recover the original PPO "
              "implementation), you have to pass a negative value (e.g. -1).")
+    parser.add_argument(
+        "--use_fp16",
+        action="store_true",
+        help="whether to compute the clipped surrogate policy objective in "
+             "half precision")
 
     return parser
 
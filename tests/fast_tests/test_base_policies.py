@@ -138,6 +138,39 @@ class TestActorCriticPolicy(unittest.TestCase):
         np.testing.assert_almost_equal(policy._get_obs(obs, context, axis=1),
                                        expected)
 
+    def test_get_single_obs(self):
+        """Check the functionality of the _get_single_obs() method.
+
+        This method is tested for three cases:
+
+        1. for a single observation and context, which are written to the
+           aligned preallocated array
+        2. when the context is None
+        3. for a batch of observations and contexts
+        """
+        policy = ActorCriticPolicy(**self.policy_params)
+
+        # test case 1
+        obs = np.array([[0, 1]])
+        context = np.array([[3, 4, 5]])
+        expected = np.array([[0, 1, 3, 4, 5]])
+        out = policy._get_single_obs(obs, context)
+        np.testing.assert_almost_equal(out, expected)
+        self.assertIs(out, policy._obs_scratch)
+        self.assertEqual(out.ctypes.data % 64, 0)
+
+        # test case 2
+        obs = np.array([[0, 1]])
+        np.testing.assert_almost_equal(
+            policy._get_single_obs(obs, None), obs)
+
+        # test case 3
+        obs = np.array([[0, 1], [2, 3]])
+        context = np.array([[3, 4, 5], [6, 7, 8]])
+        expected = np.array([[0, 1, 3, 4, 5], [2, 3, 6, 7, 8]])
+        np.testing.assert_almost_equal(
+            policy._get_single_obs(obs, context), expected)
+
     def test_get_ob_dim(self):
         """Check the functionality of the _get_ob_dim() method.
 
@@ -5,6 +5,7 @@ import tensorflow as tf
 from gym.spaces import Box
 
 from hbaselines.utils.tf_util import get_trainable_vars
+from hbaselines.utils.tf_util import gae_returns
 from hbaselines.fcnet.td3 import FeedForwardPolicy as TD3FeedForwardPolicy
 from hbaselines.fcnet.sac import FeedForwardPolicy as SACFeedForwardPolicy
 from hbaselines.fcnet.ppo import FeedForwardPolicy as PPOFeedForwardPolicy
@@ -598,6 +599,289 @@ class TestPPOFeedForwardPolicy(unittest.TestCase):
              'model/vf/output/kernel:0']
         )
 
+    def test_load_rollout(self):
+        """Check the functionality of the load_rollout() method.
+
+        This method is tested for the following cases:
+
+        1. Inputs that are fed directly do not read from the rollout buffers.
+           This is the path used by update_from_batch, and fails if the
+           minibatch iterator (not initialized here) is evaluated. The model
+           parameters are updated by this method.
+        2. The inputs are gathered from the rollout buffers by the indices in
+           mb_idx_ph, and the contextual terms are appended to the
+           observations.
+        """
+        policy = PPOFeedForwardPolicy(**self.policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+
+        n_steps = 6
+        obs = np.arange(n_steps * 2, dtype=np.float32).reshape((n_steps, 2))
+        context = -np.arange(n_steps * 3, dtype=np.float32).reshape(
+            (n_steps, 3))
+        returns = np.arange(n_steps) + 0.5
+        actions = np.arange(n_steps).reshape((n_steps, 1)) / n_steps
+        values = np.arange(n_steps) + 0.25
+        advs = np.arange(n_steps) - 2.5
+        neglogpacs = np.arange(n_steps) + 0.75
+
+        # test case 1
+        weights = policy.sess.run(get_trainable_vars())
+        policy.update_from_batch(
+            obs=obs,
+            context=context,
+            returns=returns,
+            actions=actions,
+            values=values,
+            advs=advs,
+            neglogpacs=neglogpacs,
+        )
+        new_weights = policy.sess.run(get_trainable_vars())
+        self.assertTrue(any(
+            np.any(w != new_w) for w, new_w in zip(weights, new_weights)))
+
+        # test case 2
+        policy.load_rollout(
+            obs=obs,
+            context=context,
+            returns=returns,
+            actions=actions,
+            values=values,
+            advs=advs,
+            neglogpacs=neglogpacs,
+        )
+
+        idx = np.array([4, 0, 5])
+        mb_obs, mb_returns, mb_actions, mb_values, mb_advs, mb_neglogpacs = \
+            policy.sess.run(
+                [policy.obs_ph,
+                 policy.rew_ph,
+                 policy.action_ph,
+                 policy.old_vpred_ph,
+                 policy.advs_ph,
+                 policy.old_neglog_pac_ph],
+                feed_dict={policy.mb_idx_ph: idx})
+
+        np.testing.assert_almost_equal(
+            mb_obs, np.concatenate((obs, context), axis=1)[idx])
+        np.testing.assert_almost_equal(mb_returns, returns[idx])
+        np.testing.assert_almost_equal(mb_actions, actions[idx])
+        np.testing.assert_almost_equal(mb_values, values[idx])
+        np.testing.assert_almost_equal(mb_advs, advs[idx])
+        np.testing.assert_almost_equal(mb_neglogpacs, neglogpacs[idx])
+
+    def test_init_minibatches(self):
+        """Check the functionality of the _init_minibatches() method.
+
+        This method is tested for the following cases, when the number of
+        samples is and is not divisible by the number of minibatches:
+
+        1. The returned number of minibatches matches the number of
+           minibatches provided by the iterator.
+        2. Every sample is gathered exactly once per epoch.
+        """
+        self.policy_params["n_minibatches"] = 3
+        self.policy_params["n_opt_epochs"] = 4
+        policy = PPOFeedForwardPolicy(**self.policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+
+        for n_steps, expected_n_batches in [(12, 12), (10, 16)]:
+            # The index of every sample is stored as its return.
+            zeros = np.zeros(n_steps)
+            policy.load_rollout(
+                obs=np.zeros((n_steps, 2)),
+                context=np.zeros((n_steps, 3)),
+                returns=np.arange(n_steps),
+                actions=np.zeros((n_steps, 1)),
+                values=zeros,
+                advs=zeros,
+                neglogpacs=zeros,
+            )
+
+            n_batches = policy._init_minibatches(n_steps)
+            returns = [policy.sess.run(policy.rew_ph)
+                       for _ in range(n_batches)]
+
+            # test case 1
+            self.assertEqual(n_batches, expected_n_batches)
+            self.assertRaises(tf.errors.OutOfRangeError,
+                              policy.sess.run, policy.rew_ph)
+
+            # test case 2
+            n_epoch_batches = n_batches // policy.n_opt_epochs
+            for epoch in range(policy.n_opt_epochs):
+                samples = np.concatenate(returns[
+                    epoch * n_epoch_batches:(epoch + 1) * n_epoch_batches])
+                np.testing.assert_almost_equal(
+                    np.sort(samples), np.arange(n_steps))
+
+    def test_update(self):
+        """Check the functionality of the update() method.
+
+        This method tests that the optimization procedure consumes every
+        minibatch of the iterator without running out of minibatches, when
+        the number of samples is and is not divisible by the number of
+        minibatches.
+        """
+        self.policy_params["co_space"] = None
+        self.policy_params["n_minibatches"] = 3
+        policy = PPOFeedForwardPolicy(**self.policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+
+        for n_steps in [12, 10]:
+            # Collect a rollout of samples.
+            obs = policy.ob_space.sample()
+            for step in range(n_steps):
+                action = policy.get_action(
+                    np.array([obs]), None,
+                    apply_noise=True,
+                    random_actions=False)
+                new_obs = policy.ob_space.sample()
+                policy.store_transition(
+                    obs0=obs,
+                    context0=None,
+                    action=action.flatten(),
+                    reward=1.,
+                    obs1=new_obs,
+                    context1=None,
+                    done=float(step == n_steps - 1),
+                    is_final_step=False,
+                )
+                obs = new_obs
+
+            policy.update()
+            self.assertRaises(tf.errors.OutOfRangeError,
+                              policy.sess.run, policy.mb_idx_ph)
+
+            # Clear the stored samples.
+            policy.get_td_map()
+
+    def test_get_last_values(self):
+        """Check the functionality of the _get_last_values() method.
+
+        This method is tested for the following cases:
+
+        1. The values of all environments, computed in a single call, match
+           the values computed for every environment separately.
+        2. The returns that are computed during the update procedure match
+           those computed from the per-environment values.
+        """
+        self.policy_params["co_space"] = None
+        self.policy_params["num_envs"] = 2
+        policy = PPOFeedForwardPolicy(**self.policy_params)
+        policy.sess.run(tf.compat.v1.global_variables_initializer())
+
+        # Collect a rollout of samples for every environment.
+        n_steps = 5
+        for env_num in range(policy.num_envs):
+            obs = policy.ob_space.sample()
+            for step in range(n_steps):
+                action = policy.get_action(
+                    np.array([obs]), None,
+                    apply_noise=True,
+                    random_actions=False,
+                    env_num=env_num)
+                new_obs = policy.ob_space.sample()
+                policy.store_transition(
+                    obs0=obs,
+                    context0=None,
+                    action=action.flatten(),
+                    reward=float(step),
+                    obs1=new_obs,
+                    context1=None,
+                    done=0.,
+                    is_final_step=False,
+                    env_num=env_num,
+                )
+                obs = new_obs
+
+        # test case 1
+        last_values = policy._get_last_values()
+        expected_last_values = [
+            policy.sess.run(
+                policy.value_flat,
+                feed_dict={policy.obs_ph: policy.last_obs[env_num]})
+            for env_num in range(policy.num_envs)
+        ]
+        self.assertTupleEqual(last_values.shape, (policy.num_envs,))
+        np.testing.assert_almost_equal(
+            last_values, np.concatenate(expected_last_values), decimal=5)
+
+        # test case 2
+        expected_returns = np.concatenate([
+            gae_returns(
+                mb_rewards=np.asarray(policy.mb_rewards[env_num]),
+                mb_values=np.concatenate(policy.mb_values[env_num]),
+                mb_dones=np.asarray(policy.mb_dones[env_num]),
+                last_values=expected_last_values[env_num][0],
+                gamma=policy.gamma,
+                lam=policy.lam,
+            )
+            for env_num in range(policy.num_envs)
+        ])
+        policy.update()
+        self.assertTupleEqual(
+            policy.mb_returns.shape, (policy.num_envs * n_steps,))
+        np.testing.assert_almost_equal(
+            policy.mb_returns, expected_returns, decimal=5)
+
+    def test_fp16(self):
+        """Check the functionality of the use_fp16 option.
+
+        This method tests that the loss and its gradients are finite, and
+        match those computed in single precision, when the clipped surrogate
+        objective is computed in half precision. Some of the samples have
+        probability ratios that are larger than the largest half precision
+        value, or larger than the square root of this value. For the samples
+        with negative advantages, the unclipped objective is used.
+        """
+        obs = np.zeros((5, 5))
+        actions = np.zeros((5, 1))
+        advs = np.array([1., 0.5, -1., -1., -1.])
+        returns = np.array([1., 0., -1., 0., 1.])
+        values = np.zeros(5)
+        # The log-ratios of these samples are roughly 14, 0, 3, 7, and 14.
+        neglogpacs = np.array([15., 1., 4., 8., 15.])
+
+        weights = None
+        loss = {}
+        grads = {}
+        for use_fp16 in [False, True]:
+            with tf.Graph().as_default():
+                sess = tf.compat.v1.Session()
+                policy_params = self.policy_params.copy()
+                policy_params["sess"] = sess
+                policy_params["use_fp16"] = use_fp16
+                policy = PPOFeedForwardPolicy(**policy_params)
+                sess.run(tf.compat.v1.global_variables_initializer())
+
+                # Use the same model parameters in both graphs.
+                trainable_vars = get_trainable_vars()
+                if weights is None:
+                    weights = sess.run(trainable_vars)
+                else:
+                    for var, val in zip(trainable_vars, weights):
+                        var.load(val, sess)
+
+                loss[use_fp16], grads[use_fp16] = sess.run(
+                    [policy.loss, tf.gradients(policy.loss, trainable_vars)],
+                    feed_dict={
+                        policy.obs_ph: obs,
+                        policy.action_ph: actions,
+                        policy.advs_ph: advs,
+                        policy.rew_ph: returns,
+                        policy.old_neglog_pac_ph: neglogpacs,
+                        policy.old_vpred_ph: values,
+                    })
+                sess.close()
+
+        self.assertTrue(np.isfinite(loss[True]))
+        np.testing.assert_allclose(loss[True], loss[False], rtol=1e-2)
+        for grad_fp16, grad_fp32 in zip(grads[True], grads[False]):
+            self.assertTrue(np.all(np.isfinite(grad_fp16)))
+            np.testing.assert_allclose(
+                grad_fp16, grad_fp32, rtol=1e-2, atol=1e-3)
+
 
 class TestImitationFeedForwardPolicy(unittest.TestCase):
     """Test FeedForwardPolicy in hbaselines/fcnet/imitation.py."""
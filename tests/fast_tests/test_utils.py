@@ -1,5 +1,6 @@
 """Contains tests for the model abstractions and different models."""
 import unittest
+from unittest import mock
 import tensorflow as tf
 import numpy as np
 import random
@@ -16,6 +17,12 @@ from hbaselines.utils.tf_util import conv_layer
 from hbaselines.utils.tf_util import apply_squashing_func
 from hbaselines.utils.tf_util import get_trainable_vars
 from hbaselines.utils.tf_util import gaussian_likelihood
+from hbaselines.utils.tf_util import normalize_advantages
+from hbaselines.utils.tf_util import _normalize_adv_py
+from hbaselines.utils.tf_util import flatten_grads
+from hbaselines.utils.tf_util import clip_by_global_norm_flat
+from hbaselines.utils.tf_util import flat_adam
+from hbaselines.utils.tf_util import scale_gradient
 from hbaselines.fcnet.td3 import FeedForwardPolicy \
     as TD3FeedForwardPolicy
 from hbaselines.goal_conditioned.td3 import GoalConditionedPolicy \
@@ -1352,6 +1359,7 @@ class TestTrain(unittest.TestCase):
             'n_minibatches': PPO_PARAMS['n_minibatches'],
             'n_opt_epochs': PPO_PARAMS['n_opt_epochs'],
             'vf_coef': PPO_PARAMS['vf_coef'],
+            'use_fp16': PPO_PARAMS['use_fp16'],
         })
 
         hp = get_hyperparameters(args, PPOFeedForwardPolicy)
@@ -1379,6 +1387,7 @@ class TestTrain(unittest.TestCase):
                 'n_minibatches': PPO_PARAMS['n_minibatches'],
                 'n_opt_epochs': PPO_PARAMS['n_opt_epochs'],
                 'vf_coef': PPO_PARAMS['vf_coef'],
+                'use_fp16': PPO_PARAMS['use_fp16'],
                 'l2_penalty': FEEDFORWARD_PARAMS["l2_penalty"],
                 'model_params': {
                     'model_type': model_params["model_type"],
@@ -1438,6 +1447,7 @@ class TestTrain(unittest.TestCase):
                 '--n_minibatches', '31',
                 '--n_opt_epochs', '32',
                 '--vf_coef', '33',
+                '--use_fp16',
             ],
             multiagent=False,
             hierarchical=False,
@@ -1487,6 +1497,7 @@ class TestTrain(unittest.TestCase):
             'n_minibatches': 31,
             'n_opt_epochs': 32,
             'vf_coef': 33.0,
+            'use_fp16': True,
         })
 
         hp = get_hyperparameters(args, PPOFeedForwardPolicy)
@@ -1514,6 +1525,7 @@ class TestTrain(unittest.TestCase):
                 'n_minibatches': 31,
                 'n_opt_epochs': 32,
                 'vf_coef': 33,
+                'use_fp16': True,
                 'l2_penalty': FEEDFORWARD_PARAMS["l2_penalty"],
                 'model_params': {
                     'layers': [22, 23],
@@ -2334,6 +2346,130 @@ class TestTFUtil(unittest.TestCase):
         # Clear the graph.
         tf.compat.v1.reset_default_graph()
 
+    def test_clip_by_global_norm_flat(self):
+        """Check the functionality of the clip_by_global_norm_flat() method.
+
+        This is tested for the following cases:
+
+        1. the global norm is larger than the clipping norm
+        2. the global norm is smaller than the clipping norm
+        """
+        grads = [tf.constant([[3., 0.], [0., 0.]]), tf.constant([4., 0.])]
+        var_list = [tf.zeros((2, 2)), tf.zeros(2)]
+        flat_grad = flatten_grads(grads, var_list)
+
+        # test case 1
+        clipped, norm = clip_by_global_norm_flat(flat_grad, 1.)
+        expected, expected_norm = tf.clip_by_global_norm(grads, 1.)
+        np.testing.assert_almost_equal(self.sess.run(norm), 5.)
+        np.testing.assert_almost_equal(
+            self.sess.run(clipped),
+            self.sess.run(flatten_grads(expected, var_list)))
+
+        # test case 2
+        clipped, norm = clip_by_global_norm_flat(flat_grad, 10.)
+        np.testing.assert_almost_equal(self.sess.run(norm), 5.)
+        np.testing.assert_almost_equal(
+            self.sess.run(clipped), [3., 0., 0., 0., 4., 0.])
+
+        # Clear the graph.
+        tf.compat.v1.reset_default_graph()
+
+    def test_scale_gradient(self):
+        """Check the functionality of the scale_gradient() method.
+
+        This method tests that the output matches the input, and that the
+        gradient with respect to the input is multiplied by the scale.
+        """
+        x = tf.constant([1., 2.])
+        y = scale_gradient(x, 4.)
+        np.testing.assert_almost_equal(self.sess.run(y), [1., 2.])
+        np.testing.assert_almost_equal(
+            self.sess.run(tf.gradients(tf.reduce_sum(3. * y), x)[0]),
+            [12., 12.])
+
+        # Clear the graph.
+        tf.compat.v1.reset_default_graph()
+
+    def test_flat_adam(self):
+        """Check the functionality of the flat_adam() method.
+
+        This is done by validating that the updates match those of the Adam
+        optimizer in tensorflow after several steps.
+        """
+        init_vals = [np.array([[1., -2.], [3., 0.5]]), np.array([0.1, -0.3])]
+
+        # Create two copies of the same variables.
+        var_list1 = [tf.Variable(val, dtype=tf.float32) for val in init_vals]
+        var_list2 = [tf.Variable(val, dtype=tf.float32) for val in init_vals]
+
+        # Create a loss for each set of variables.
+        def loss_fn(var_list):
+            return tf.reduce_sum(tf.square(var_list[0])) \
+                + tf.reduce_sum(tf.sin(var_list[1]))
+
+        loss1 = loss_fn(var_list1)
+        loss2 = loss_fn(var_list2)
+
+        # Create the optimizers.
+        grads = tf.gradients(loss1, var_list1)
+        optimizer1 = flat_adam(
+            flat_grad=flatten_grads(grads, var_list1),
+            var_list=var_list1,
+            learning_rate=0.1,
+            epsilon=1e-5,
+        )
+        optimizer2 = tf.compat.v1.train.AdamOptimizer(
+            learning_rate=0.1, epsilon=1e-5).minimize(
+            loss2, var_list=var_list2)
+
+        # Run a few update steps.
+        self.sess.run(tf.compat.v1.global_variables_initializer())
+        for _ in range(5):
+            self.sess.run([optimizer1, optimizer2])
+
+        # Check that the variables match.
+        for var1, var2 in zip(var_list1, var_list2):
+            np.testing.assert_almost_equal(
+                self.sess.run(var1), self.sess.run(var2), decimal=5)
+
+        # Clear the graph.
+        tf.compat.v1.reset_default_graph()
+
+    def test_normalize_advantages(self):
+        """Check the functionality of the normalize_advantages() method."""
+        mb_returns = np.array([1, 2, 3, 4, 5])
+        mb_values = np.array([0, 0, 1, 1, 1])
+        advs = normalize_advantages(mb_returns, mb_values)
+
+        # Test the output type.
+        self.assertEqual(advs.dtype, np.float32)
+
+        # Test the outputs are normalized.
+        np.testing.assert_almost_equal(
+            advs, [-1.3728129, -0.3922323, -0.3922323, 0.5883484, 1.5689291],
+            decimal=5)
+        self.assertAlmostEqual(np.mean(advs), 0, places=5)
+        self.assertAlmostEqual(np.std(advs), 1, places=5)
+
+    def test_normalize_adv_py(self):
+        """Check the functionality of the _normalize_adv_py() method.
+
+        This method tests that the single pass implementation, which is used
+        when numba is available, matches the numpy implementation in
+        normalize_advantages().
+        """
+        np.random.seed(0)
+        mb_returns = 100 + 10 * np.random.randn(1000)
+        mb_values = np.random.randn(1000)
+        advs = np.empty(1000, dtype=np.float32)
+        _normalize_adv_py(mb_returns, mb_values, advs)
+
+        with mock.patch("hbaselines.utils.tf_util._normalize_adv", None):
+            expected_advs = normalize_advantages(mb_returns, mb_values)
+
+        np.testing.assert_almost_equal(advs, expected_advs, decimal=5)
+
 
 def test_space(gym_space, expected_size, expected_min, expected_max):
     """Test the shape and bounds of an action or observation space.